@@ -1,17 +1,58 @@
 import os
 import json
-import requests
+import queue
+import asyncio
+import logging
+import aiohttp
+import orjson
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from urllib.parse import urlencode
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, request, jsonify
+from quart.json.provider import JSONProvider
+from quart_cors import cors
 from supabase import create_client, Client
+from pydantic import BaseModel, Field, ValidationError
 from datetime import datetime, timedelta, timezone
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = Flask(__name__)
+# --- Logging ---
+# Records are handed off to a background thread through a queue, so log
+# formatting and stdout writes never block a request (or the event loop).
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(
+    _log_queue,
+    logging.StreamHandler(),
+    respect_handler_level=True,
+)
+_log_listener.start()
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    handlers=[QueueHandler(_log_queue)],
+)
+logger = logging.getLogger(__name__)
+
+def mask_secret(value):
+    """Truncates a credential for logging; full codes/tokens never hit the logs."""
+    if not value:
+        return value
+    return value[:6] + "…"
+
+# --- orjson-backed JSON provider ---
+# jsonify and request.get_json() both go through the app's JSON provider;
+# orjson serializes/parses several times faster than the stdlib json module.
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
 
 # --- Initialize Supabase ---
 try:
@@ -20,9 +61,9 @@ try:
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env")
     supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase client initialized.")
+    logger.info("✅ Supabase client initialized.")
 except Exception as e:
-    print(f"❌ FATAL: Supabase client failed to initialize: {e}")
+    logger.error(f"❌ FATAL: Supabase client failed to initialize: {e}")
     supabase = None
 
 # --- CORS Configuration ---
@@ -32,19 +73,136 @@ origins = [
     "http://localhost:5173",
     "http://127.0.0.1:5173"
 ]
-CORS(app, resources={r"/*": {"origins": origins}}, supports_credentials=True)
+app = cors(app, allow_origin=origins, allow_credentials=True)
+
+# --- Shared outbound HTTP session ---
+# One pooled aiohttp session for all provider calls, so concurrent OAuth
+# exchanges reuse connections instead of opening a new TCP+TLS one each time.
+http_session: aiohttp.ClientSession = None
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+# Transient provider errors worth retrying (rate limits / upstream hiccups).
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+@app.before_serving
+async def create_http_session():
+    global http_session
+    # aiohttp speaks HTTP/1.1 only, so the latency win here comes from
+    # keep-alive: idle provider connections stay warm for 30s and skip the
+    # TCP+TLS handshake on the next exchange.
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=20,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+        ),
+        timeout=HTTP_TIMEOUT,
+    )
+    logger.info("✅ Outbound HTTP session created.")
+
+@app.after_serving
+async def close_http_session():
+    if http_session:
+        await http_session.close()
+
+# --- Background token writer ---
+# Token upserts are queued and flushed in batches by a background task, so
+# a successful OAuth exchange responds without waiting on the Supabase RTT.
+# Persistence lags by at most FLUSH_MAX_WAIT seconds.
+token_queue: asyncio.Queue = None
+flusher_task: asyncio.Task = None
+FLUSH_BATCH_SIZE = 50
+FLUSH_MAX_WAIT = 0.2
+
+def _bulk_upsert(records):
+    return supabase.from_("social_connections") \
+                    .upsert(records, on_conflict="user_id, platform") \
+                    .execute()
+
+async def flush_token_queue():
+    """Drains queued token records and bulk-upserts them: one write per
+    FLUSH_BATCH_SIZE records, or per FLUSH_MAX_WAIT window, whichever
+    fills first."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await token_queue.get()]
+        deadline = loop.time() + FLUSH_MAX_WAIT
+        while len(batch) < FLUSH_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(token_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await asyncio.to_thread(_bulk_upsert, batch)
+            logger.info(f"✅ Flushed {len(batch)} token record(s) to Supabase.")
+        except Exception as e:
+            logger.error(f"❌ Supabase batch save failed: {e}")
+
+@app.before_serving
+async def start_token_flusher():
+    global token_queue, flusher_task
+    token_queue = asyncio.Queue()
+    flusher_task = asyncio.ensure_future(flush_token_queue())
+
+@app.after_serving
+async def stop_token_flusher():
+    if flusher_task:
+        flusher_task.cancel()
+        try:
+            await flusher_task
+        except asyncio.CancelledError:
+            pass
+    # Persist anything still queued before shutting down.
+    leftover = []
+    while token_queue and not token_queue.empty():
+        leftover.append(token_queue.get_nowait())
+    if leftover and supabase:
+        try:
+            await asyncio.to_thread(_bulk_upsert, leftover)
+        except Exception as e:
+            logger.error(f"❌ Final Supabase flush failed: {e}")
+
+async def provider_request(method, url, retries=3, backoff=0.2, **kwargs):
+    """Issues an outbound request on the shared session, retrying transient
+    provider errors with exponential backoff. Returns the final response;
+    the connection is recycled into the pool once the body is read."""
+    res = None
+    for attempt in range(retries + 1):
+        res = await http_session.request(method, url, **kwargs)
+        if res.status in RETRY_STATUSES and attempt < retries:
+            res.release()
+            await asyncio.sleep(backoff * (2 ** attempt))
+            continue
+        break
+    return res
+
+# -------------------- REQUEST BODY SCHEMA --------------------
+class TokenExchangeRequest(BaseModel):
+    """Body shared by all three /<provider>/token endpoints. Pydantic's
+    compiled core rejects missing/empty fields without any manual checks."""
+    code: str = Field(min_length=1)
+    userId: str = Field(min_length=1)
+    platform: str = Field(min_length=1)
+    redirect_uri: str | None = None
+    code_verifier: str | None = None
 
 # -------------------- HELPER FOR ERROR CHECKING --------------------
+@lru_cache(maxsize=None)
 def get_env_var(var_name):
-    """Gets an env var or raises an error if missing."""
+    """Gets an env var or raises an error if missing. Config never changes
+    at runtime, so lookups are cached after the first call."""
     value = os.getenv(var_name)
     if not value:
-        print(f"❌ FATAL ERROR: Environment variable '{var_name}' is not set.")
+        logger.error(f"❌ FATAL ERROR: Environment variable '{var_name}' is not set.")
         raise ValueError(f"Missing required config: {var_name}")
     return value
 
 # -------------------- HELPER TO SAVE TOKEN --------------------
-def save_token_to_supabase(user_id, platform, token_data):
+async def save_token_to_supabase(user_id, platform, token_data):
     if not supabase:
         raise Exception("Supabase client is not initialized.")
 
@@ -64,186 +222,145 @@ def save_token_to_supabase(user_id, platform, token_data):
         "expires_at": expires_at
     }
 
-    print(f"🔄 Upserting token for {platform} user {user_id}...")
-    try:
-        response = supabase.from_("social_connections") \
-                             .upsert(record_to_upsert, on_conflict="user_id, platform") \
-                             .execute()
-        
-        print(f"✅ Token saved successfully.")
-        return True 
-
-    except Exception as e:
-        print(f"❌ Supabase save failed: {e}")
-        raise e
+    logger.info(f"🔄 Queueing token for {platform} user {user_id}...")
+    # The background flusher batches queued records into bulk upserts, so
+    # the handler returns without paying the Supabase round-trip.
+    await token_queue.put(record_to_upsert)
+    return True
+
+# -------------------- TOKEN EXCHANGE (ALL PROVIDERS) --------------------
+# The three provider handlers were ~95% identical; everything that differs
+# between them lives in this table and one shared handler serves all of them.
+PROVIDERS = {
+    "facebook": {
+        "token_url": "https://graph.facebook.com/v24.0/oauth/access_token",
+        "method": "GET",
+        "send_as": "params",
+        "client_id_env": "FACEBOOK_CLIENT_ID",
+        "client_secret_env": "FACEBOOK_CLIENT_SECRET",
+        "grant_type": None,
+        "error_label": "Facebook token exchange failed",
+        "missing_fields_error": "Missing 'code', 'userId', or 'platform'",
+    },
+    "linkedin": {
+        "token_url": "https://www.linkedin.com/oauth/v2/accessToken",
+        "method": "POST",
+        "send_as": "data",
+        "client_id_env": "LINKEDIN_CLIENT_ID",
+        "client_secret_env": "LINKEDIN_CLIENT_SECRET",
+        "grant_type": "authorization_code",
+        "headers": {"Accept": "application/json"},
+        "error_label": "LinkedIn token exchange failed",
+        "missing_fields_error": "Missing required fields (code, userId, platform)",
+        # LinkedIn rejections are usually redirect_uri mismatches; pass the
+        # provider status through and point the frontend at the likely cause.
+        "forward_status": True,
+        "redirect_hint": True,
+        "redirect_fallback_env": "LINKEDIN_REDIRECT_URI",
+        "success_message": "Token saved successfully",
+    },
+    "youtube": {
+        "token_url": "https://oauth2.googleapis.com/token",
+        "method": "POST",
+        "send_as": "data",
+        "client_id_env": "GOOGLE_CLIENT_ID",
+        "client_secret_env": "GOOGLE_CLIENT_SECRET",
+        "grant_type": "authorization_code",
+        "error_label": "Token exchange failed",
+        "missing_fields_error": "Missing 'code', 'userId', or 'platform'",
+    },
+}
+
+# Token-exchange bodies are a handful of short strings; anything bigger is
+# rejected from the Content-Length header before the body is even read.
+MAX_BODY_BYTES = 64 * 1024
+
+@app.route("/<provider>/token", methods=['POST'])
+async def exchange_token(provider):
+    entry = PROVIDERS.get(provider)
+    if not entry:
+        return jsonify({"error": f"Unknown provider '{provider}'"}), 404
+
+    if request.content_length and request.content_length > MAX_BODY_BYTES:
+        return jsonify({"error": "Request body too large"}), 413
 
-# -------------------- FACEBOOK TOKEN EXCHANGE --------------------
-@app.route("/facebook/token", methods=['POST'])
-def exchange_facebook_token():
     try:
-        data = request.get_json()
-        code = data.get("code")
-        user_id = data.get("userId")
-        platform = data.get("platform")
-        redirect_uri = data.get("redirect_uri")
-
-        if not all([code, user_id, platform]):
-            return jsonify({"error": "Missing 'code', 'userId', or 'platform'"}), 400
-        
-        # Default fallback if frontend doesn't send it, but frontend SHOULD send it
+        try:
+            # Feed the raw body straight into pydantic-core: one parse pass
+            # in Rust, no intermediate Python dict from get_json().
+            body = TokenExchangeRequest.model_validate_json(await request.get_data())
+        except ValidationError:
+            return jsonify({"error": entry["missing_fields_error"]}), 400
+
+        # Prefer the redirect_uri sent by the frontend; a mismatch with the
+        # URI used during authorization is the classic cause of 400s here.
+        redirect_uri = (body.redirect_uri or "").strip()
         if not redirect_uri:
-            print("⚠️ WARNING: No redirect_uri received from frontend. Defaulting to localhost:8080.")
-            redirect_uri = "http://localhost:8080/auth/callback"
+            fallback_env = entry.get("redirect_fallback_env")
+            redirect_uri = (os.getenv(fallback_env) if fallback_env else None) \
+                            or "http://localhost:8080/auth/callback"
+            logger.warning(f"⚠️ WARNING: No redirect_uri received from frontend. "
+                           f"Falling back to {redirect_uri}. Ensure this matches your frontend!")
 
-        print("🔁 Received Facebook code:", code)
-        print(f"   Using redirect_uri: {redirect_uri}")
-
-        params = {
-            "client_id": get_env_var("FACEBOOK_CLIENT_ID"),
-            "client_secret": get_env_var("FACEBOOK_CLIENT_SECRET"),
-            "redirect_uri": redirect_uri, 
-            "code": code,
-        }
-        
-        res = requests.get("https://graph.facebook.com/v24.0/oauth/access_token", params=params)
-        res.raise_for_status()
-        token_data = res.json()
-
-        # Save to Supabase
-        save_token_to_supabase(user_id, platform, token_data)
-        
-        return jsonify({"success": True})
-
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Facebook token exchange error: {e.response.text if e.response else str(e)}")
-        return jsonify({"error": "Facebook token exchange failed", "details": e.response.text if e.response else str(e)}), 500
-    except Exception as e:
-        print(f"❌ Server error: {str(e)}")
-        return jsonify({"error": "An internal server error occurred", "details": str(e)}), 500
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔁 Received %s code: %s", provider, mask_secret(body.code))
+            logger.debug("   Using redirect_uri: %s", redirect_uri)
 
-# -------------------- LINKEDIN TOKEN EXCHANGE --------------------
-@app.route("/linkedin/token", methods=['POST'])
-def exchange_linkedin_token():
-    try:
-        data = request.get_json()
-        
-        # 1. Validation
-        if not data:
-            return jsonify({"error": "No JSON data received"}), 400
-            
-        code = data.get("code")
-        user_id = data.get("userId")
-        platform = data.get("platform")
-        redirect_uri_param = data.get("redirect_uri") # Crucial
-        code_verifier = data.get("code_verifier") 
-
-        if not all([code, user_id, platform]):
-            return jsonify({"error": "Missing required fields (code, userId, platform)"}), 400
-
-        # 2. Determine Redirect URI
-        # The logs showed a mismatch. We prioritize the URI sent from the frontend.
-        redirect_uri = None
-        if redirect_uri_param:
-            redirect_uri = redirect_uri_param.strip()
-            print(f"✅ Using redirect_uri from request: {redirect_uri}")
-        else:
-            # Fallback (This usually causes the 400 error if it doesn't match frontend)
-            redirect_uri = os.getenv("LINKEDIN_REDIRECT_URI", "http://localhost:8080/auth/callback")
-            print(f"⚠️  WARNING: Using fallback redirect_uri: {redirect_uri}. Ensure this matches your frontend!")
-
-        # 3. Prepare Payload
-        client_id = get_env_var("LINKEDIN_CLIENT_ID")
-        client_secret = get_env_var("LINKEDIN_CLIENT_SECRET")
-        
-        token_url = "https://www.linkedin.com/oauth/v2/accessToken"
-        
         payload = {
-            "grant_type": "authorization_code",
-            "code": code.strip(),
-            "redirect_uri": redirect_uri, 
-            "client_id": client_id,
-            "client_secret": client_secret,
+            "client_id": get_env_var(entry["client_id_env"]),
+            "client_secret": get_env_var(entry["client_secret_env"]),
+            "redirect_uri": redirect_uri,
+            "code": body.code.strip(),
         }
-        
-        if code_verifier:
-            payload["code_verifier"] = code_verifier.strip()
-        
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept": "application/json"
-        }
-        
-        print(f"🔄 Exchanging LinkedIn token...")
-        
-        # 4. Execute Request
-        res = requests.post(token_url, data=payload, headers=headers, timeout=30)
-        
-        # 5. Handle Errors
-        if res.status_code != 200:
-            print(f"❌ LinkedIn Error {res.status_code}: {res.text}")
-            return jsonify({
-                "error": "LinkedIn token exchange failed", 
-                "details": res.text,
-                "hint": f"Ensure '{redirect_uri}' matches EXACTLY the URI used in your frontend logic."
-            }), res.status_code
-
-        token_data = res.json()
-        
-        # 6. Save to DB
-        save_token_to_supabase(user_id, platform, token_data)
-
-        print(f"✅ LinkedIn token exchange successful for user {user_id}")
-        return jsonify({"success": True, "message": "Token saved successfully"})
-
-    except Exception as e:
-        print(f"❌ Server error: {str(e)}")
-        return jsonify({"error": "Internal server error", "details": str(e)}), 500
-
-# -------------------- YOUTUBE TOKEN EXCHANGE --------------------
-@app.route("/youtube/token", methods=['POST'])
-def exchange_youtube_token():
-    try:
-        data = request.get_json()
-        code = data.get("code")
-        user_id = data.get("userId")
-        platform = data.get("platform")
-        redirect_uri = data.get("redirect_uri")
-
-        if not all([code, user_id, platform]):
-            return jsonify({"error": "Missing 'code', 'userId', or 'platform'"}), 400
-
-        # Default fallback
-        if not redirect_uri:
-            print("⚠️ WARNING: No redirect_uri received from frontend. Defaulting to localhost:8080.")
-            redirect_uri = "http://localhost:8080/auth/callback"
-
-        print("🔁 Received YouTube code:", code)
-        print(f"   Using redirect_uri: {redirect_uri}")
-
-        params = {
-            "client_id": get_env_var("GOOGLE_CLIENT_ID"),
-            "client_secret": get_env_var("GOOGLE_CLIENT_SECRET"),
-            "code": code,
-            "grant_type": "authorization_code",
-            "redirect_uri": redirect_uri, 
-        }
-        
-        res = requests.post("https://oauth2.googleapis.com/token", data=params)
-        res.raise_for_status()
-        token_data = res.json()
+        if entry["grant_type"]:
+            payload["grant_type"] = entry["grant_type"]
+        if body.code_verifier:
+            payload["code_verifier"] = body.code_verifier.strip()
+
+        logger.info(f"🔄 Exchanging {provider} token...")
+
+        res = await provider_request(
+            entry["method"],
+            entry["token_url"],
+            headers=entry.get("headers"),
+            **{entry["send_as"]: payload},
+        )
+
+        if res.status != 200:
+            details = await res.text()
+            logger.error(f"❌ {provider} token exchange error {res.status}: {details}")
+            error_body = {"error": entry["error_label"], "details": details}
+            if entry.get("redirect_hint"):
+                error_body["hint"] = f"Ensure '{redirect_uri}' matches EXACTLY the URI used in your frontend logic."
+            return jsonify(error_body), res.status if entry.get("forward_status") else 500
+
+        token_data = await res.json()
 
         # Save to Supabase
-        save_token_to_supabase(user_id, platform, token_data)
-        
-        return jsonify({"success": True})
+        await save_token_to_supabase(body.userId, body.platform, token_data)
+
+        logger.info(f"✅ {provider} token exchange successful for user {body.userId}")
+        success_body = {"success": True}
+        if entry.get("success_message"):
+            success_body["message"] = entry["success_message"]
+        return jsonify(success_body)
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ YouTube token exchange error: {e.response.text if e.response else str(e)}")
-        return jsonify({"error": "Token exchange failed", "details": e.response.text if e.response else str(e)}), 500
+    except aiohttp.ClientError as e:
+        logger.error(f"❌ {provider} token exchange error: {e}")
+        return jsonify({"error": entry["error_label"], "details": str(e)}), 500
     except Exception as e:
-        print(f"❌ Server error: {str(e)}")
+        logger.error(f"❌ Server error: {str(e)}")
         return jsonify({"error": "An internal server error occurred", "details": str(e)}), 500
 
 if __name__ == "__main__":
-    print("✅ Starting Flask backend server (Token Handler)...")
-    app.run(port=8000, debug=True)
+    import uvicorn
+    logger.info("✅ Starting Quart backend server (Token Handler) under uvicorn...")
+    # One worker per core; the app is ASGI so each worker multiplexes
+    # concurrent OAuth callbacks on its own event loop. Prefer the
+    # C-implemented event loop and HTTP parser when they are installed.
+    try:
+        import uvloop, httptools  # noqa: F401
+        loop, http = "uvloop", "httptools"
+    except ImportError:
+        loop, http = "auto", "auto"
+    uvicorn.run("main:app", port=8000, workers=os.cpu_count(), loop=loop, http=http)